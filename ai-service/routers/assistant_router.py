@@ -13,17 +13,16 @@ from typing import Optional, Literal
 from langchain_openai import ChatOpenAI
 from langchain.schema import HumanMessage, SystemMessage
 import json
-from utils.openai_key_check import require_openai_key, get_openai_key_or_none
+from utils.openai_key_check import require_openai_key, OPENAI_KEY, HAS_OPENAI_KEY
 
 router = APIRouter()
 
 # Initialize LLM (will be None if key not configured)
-openai_key = get_openai_key_or_none()
 llm = ChatOpenAI(
     model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
     temperature=0.7,
-    api_key=openai_key
-) if openai_key else None
+    api_key=OPENAI_KEY
+) if HAS_OPENAI_KEY else None
 
 class UserContext(BaseModel):
     """User context for personalization"""
@@ -410,8 +409,8 @@ async def chat_with_assistant(request: AssistantRequest):
         
         # If asking for recommendations AND has user context with interests, use recommendations service
         if is_recommendation_request and request.user_context and hasattr(request.user_context, 'role'):
-            from services.recommendations_service import RecommendationsService
-            recommendations_service = RecommendationsService()
+            from services.recommendations_service import get_recommendations_service
+            recommendations_service = get_recommendations_service()
             
             # Get personalized recommendations
             rec_result = await recommendations_service.get_personalized_recommendations(
@@ -49,7 +49,8 @@ class BatchModerateResponse(BaseModel):
     """Response for batch comment moderation"""
     total: int = Field(..., description="Total comments processed")
     flagged: int = Field(..., description="Number of flagged comments")
-    results: list[dict] = Field(..., description="Individual results")
+    failed: int = Field(0, description="Number of comments that could not be moderated")
+    results: list[dict] = Field(..., description="Individual results, or {id, error} for failures")
 
 class ContentAnalysisRequest(BaseModel):
     """Request for deep content analysis"""
@@ -15,11 +15,11 @@ Helps students discover relevant events they might be interested in.
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel, Field
 from typing import Optional, Literal
-from services.recommendations_service import RecommendationsService
+from services.recommendations_service import get_recommendations_service
 from utils.openai_key_check import require_openai_key
 
 router = APIRouter()
-recommendations_service = RecommendationsService()
+recommendations_service = get_recommendations_service()
 
 class UserProfile(BaseModel):
     """User profile for recommendations"""
@@ -10,36 +10,171 @@ Detects: profanity, hate speech, harassment, spam, inappropriate content
 
 import os
 import re
+import string
+import asyncio
+import hashlib
+import httpx
+import numpy as np
 from typing import Optional, Literal
+from cachetools import LFUCache
+from pydantic import BaseModel, Field
+from openai import RateLimitError, APIConnectionError, InternalServerError
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
 from better_profanity import profanity
-from langchain_openai import ChatOpenAI
+from better_profanity.constants import ALLOWED_CHARACTERS
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain.prompts import ChatPromptTemplate
 from langchain.schema import HumanMessage, SystemMessage
 
+# Translation table deleting ASCII capitals; the length difference counts caps in
+# C. Only valid for ASCII text, see _check_spam
+_UPPER_STRIP = str.maketrans('', '', string.ascii_uppercase)
+
+# Short, common feedback that is always appropriate and skips every layer
+_ALLOWLIST = frozenset([
+    "great", "nice", "thanks", "thank you", "good", "ok", "okay", "cool",
+    "awesome", "amazing", "loved it", "👍", "❤️", "🔥", "👏",
+])
+
+# Severity levels in escalation order, with their rank for O(1) comparison
+_SEVERITY_LEVELS = ("none", "low", "medium", "high", "critical")
+_SEVERITY_RANK = {level: rank for rank, level in enumerate(_SEVERITY_LEVELS)}
+
+# Category weights for the overall toxicity score
+_TOXICITY_WEIGHTS = (
+    ("toxicity", 0.3),
+    ("harassment", 0.3),
+    ("hate_speech", 0.25),
+    ("inappropriate", 0.15),
+)
+
+# Longest wait between LLM retries, whether from backoff or a retry-after header
+_LLM_MAX_WAIT = 20
+_llm_backoff = wait_random_exponential(min=1, max=_LLM_MAX_WAIT)
+
+def _wait_retry_after(retry_state) -> float:
+    """Honor the server's retry-after header (capped, so one slow hint can't hold a
+    concurrency slot for minutes), else back off exponentially with jitter"""
+    error = retry_state.outcome.exception()
+    response = getattr(error, "response", None)
+    if response is not None:
+        try:
+            retry_after = float(response.headers.get("retry-after"))
+        except (TypeError, ValueError):
+            retry_after = 0
+        if retry_after > 0:
+            return min(retry_after, _LLM_MAX_WAIT)
+    return _llm_backoff(retry_state)
+
+class ModerationScores(BaseModel):
+    """Structured LLM moderation verdict"""
+    toxicity: float = Field(..., description="General toxic/negative content (0-1)")
+    harassment: float = Field(..., description="Targeting individuals or groups (0-1)")
+    hate_speech: float = Field(..., description="Discriminatory language (0-1)")
+    inappropriate: float = Field(..., description="Inappropriate for a university setting (0-1)")
+    confidence: float = Field(..., description="Confidence in this assessment (0-1)")
+
+# Strict JSON schema for requests that bypass LangChain (Batch API)
+_MODERATION_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "ModerationScores",
+        "strict": True,
+        "schema": {**ModerationScores.model_json_schema(), "additionalProperties": False}
+    }
+}
+
 class ModerationService:
     """Service for AI-powered comment moderation"""
     
+    # LLM score categories and the severity each raises when over threshold
+    _LLM_FLAGS = (
+        ("toxicity", "high"),
+        ("harassment", "critical"),
+        ("hate_speech", "critical"),
+        ("inappropriate", "medium"),
+    )
+    
     def __init__(self):
         # Initialize profanity filter
         profanity.load_censor_words()
         
+        # better-profanity compares every word against its whole word list one
+        # by one. Pre-gate it with a hash set of word "skeletons" (each character
+        # replaced by a representative of its leetspeak substitution class): a
+        # comment can only be censored if a word, or a run of consecutive words,
+        # shares a skeleton with a censor word.
+        self._profanity_skeleton = str.maketrans(self._substitution_classes(profanity.CHARS_MAPPING))
+        self._profanity_skeletons = frozenset(
+            str(word).translate(self._profanity_skeleton) for word in profanity.CENSOR_WORDSET
+        )
+        self._profanity_max_words = profanity.MAX_NUMBER_COMBINATIONS + 1
+        self._profanity_word = re.compile(
+            "[" + "".join(re.escape(char) for char in sorted(ALLOWED_CHARACTERS)) + "]+"
+        )
+        
+        # Shared HTTP client so LLM calls reuse pooled connections to OpenAI
+        self._http = httpx.AsyncClient(
+            timeout=60.0,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+            http2=True
+        )
+        
+        # Routes requests sharing the static system prompt to the same cache partition
+        self.prompt_cache_key = os.getenv("MODERATION_PROMPT_CACHE_KEY", "moderation-v1")
+        
         # Initialize LLM for contextual analysis
         self.llm = ChatOpenAI(
             model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
             temperature=0,  # Deterministic for moderation
-            api_key=os.getenv("OPENAI_API_KEY")
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_async_client=self._http,
+            max_retries=0,  # Retries are handled by _invoke_llm
+            extra_body={"prompt_cache_key": self.prompt_cache_key}
         )
+        # Guaranteed-valid JSON with fixed keys via OpenAI structured outputs
+        self.structured_llm = self.llm.with_structured_output(ModerationScores, method="json_schema")
         
         self.threshold = float(os.getenv("MODERATION_THRESHOLD", "0.7"))
         self.auto_flag_threshold = float(os.getenv("AUTO_FLAG_THRESHOLD", "0.9"))
+        self.concurrency = int(os.getenv("MODERATION_CONCURRENCY", "8"))
+        # Shared by every caller, so MODERATION_CONCURRENCY caps OpenAI calls process-wide
+        self._llm_sem = asyncio.Semaphore(self.concurrency)
         
-        # Common spam patterns
+        # Promotional keyword followed by an urgency trigger, scanned in two
+        # linear passes instead of a backtracking `.*` between the groups
+        self.spam_keywords = re.compile(r'buy|click|free|win|winner|prize|offer|discount|sale', re.IGNORECASE)
+        self.spam_triggers = re.compile(r'\b(now|today|limited)\b', re.IGNORECASE)
+        self.spam_keyword_source = r'(buy|click|free|win|winner|prize|offer|discount|sale).*\b(now|today|limited)\b'
+        
+        # Common spam patterns, compiled once as (compiled, source) pairs
         self.spam_patterns = [
-            r'(buy|click|free|win|winner|prize|offer|discount|sale).*\b(now|today|limited)\b',
-            r'http[s]?://(?![^\s]*guc)',  # External links (not GUC)
-            r'(.)\1{4,}',  # Repeated characters
-            r'\b(dm|message|contact)\s+me\b',
+            (re.compile(pattern, re.IGNORECASE), pattern)
+            for pattern in [
+                r'http[s]?://(?![^\s]*guc)',  # External links (not GUC)
+                r'(.)\1{4,}',  # Repeated characters
+                r'\b(dm|message|contact)\s+me\b',
+            ]
         ]
+        
+        # LLM verdicts are deterministic (temperature=0), so cache them by prompt hash
+        self._verdict_cache = LFUCache(maxsize=int(os.getenv("MODERATION_CACHE_SIZE", "50000")))
+        self.stats = {"hits": 0, "misses": 0, "semantic_hits": 0}
+        
+        # Semantic cache: paraphrased comments reuse the verdict of a near-duplicate.
+        # Unit-normalized embeddings live in a fixed-size ring buffer, so cosine
+        # similarity is a single matrix-vector product.
+        self.embeddings = OpenAIEmbeddings(
+            model=os.getenv("MODERATION_EMBEDDING_MODEL", "text-embedding-3-small"),
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_async_client=self._http
+        )
+        self.semantic_threshold = float(os.getenv("MODERATION_SEMANTIC_THRESHOLD", "0.92"))
+        self.semantic_min_length = 20  # Embedding overhead outweighs savings below this
+        self._semantic_capacity = int(os.getenv("MODERATION_SEMANTIC_CACHE_SIZE", "5000"))
+        self._semantic_vectors: Optional[np.ndarray] = None
+        self._semantic_entries: list[tuple[str, dict]] = []  # (context key, verdict)
+        self._semantic_next = 0
     
     async def moderate_comment(
         self,
@@ -55,9 +190,31 @@ class ModerationService:
         Returns:
             ModerationResult with is_appropriate, confidence, flags, severity
         """
+        # Fast path: trivially safe short feedback needs no analysis
+        if comment.strip().rstrip("!.").lower() in _ALLOWLIST:
+            return {
+                "is_appropriate": True,
+                "confidence": 1.0,
+                "flags": [],
+                "severity": "none",
+                "suggestion": None,
+                "detected_issues": None
+            }
+        
+        flags, severity, detected_issues = self.run_local_layers(comment)
+        confidence = 1.0
+        
+        # Layer 3: LLM contextual analysis (for longer comments or when basic checks pass)
+        if self.needs_llm(comment, flags):
+            llm_result = await self._llm_analysis(comment, context)
+            severity, confidence = self.apply_llm_result(llm_result, flags, severity, detected_issues)
+        
+        return self.build_result(flags, severity, confidence, detected_issues)
+    
+    def run_local_layers(self, comment: str) -> tuple[list, str, dict]:
+        """Run the fast local layers and return (flags, severity, detected_issues)"""
         flags = []
         severity = "none"
-        confidence = 1.0
         detected_issues = {}
         
         # Layer 1: Fast local profanity check
@@ -74,32 +231,37 @@ class ModerationService:
             detected_issues["spam"] = spam_result
             severity = self._escalate_severity(severity, "low")
         
-        # Layer 3: LLM contextual analysis (for longer comments or when basic checks pass)
-        if len(comment) > 20 or not flags:
-            llm_result = await self._llm_analysis(comment, context)
-            
-            if llm_result.get("toxicity", 0) > self.threshold:
-                flags.append("toxicity")
-                detected_issues["toxicity"] = {"score": llm_result["toxicity"]}
-                severity = self._escalate_severity(severity, "high")
-            
-            if llm_result.get("harassment", 0) > self.threshold:
-                flags.append("harassment")
-                detected_issues["harassment"] = {"score": llm_result["harassment"]}
-                severity = self._escalate_severity(severity, "critical")
-            
-            if llm_result.get("hate_speech", 0) > self.threshold:
-                flags.append("hate_speech")
-                detected_issues["hate_speech"] = {"score": llm_result["hate_speech"]}
-                severity = self._escalate_severity(severity, "critical")
-            
-            if llm_result.get("inappropriate", 0) > self.threshold:
-                flags.append("inappropriate")
-                detected_issues["inappropriate"] = {"score": llm_result["inappropriate"]}
-                severity = self._escalate_severity(severity, "medium")
-            
-            confidence = llm_result.get("confidence", 0.8)
+        return flags, severity, detected_issues
+    
+    def needs_llm(self, comment: str, flags: list) -> bool:
+        """Whether a comment should go through LLM contextual analysis"""
+        return len(comment) > 20 or not flags
+    
+    def apply_llm_result(
+        self,
+        llm_result: dict,
+        flags: list,
+        severity: str,
+        detected_issues: dict
+    ) -> tuple[str, float]:
+        """Merge LLM scores into flags/detected_issues; return (severity, confidence)"""
+        for key, key_severity in self._LLM_FLAGS:
+            score = llm_result.get(key, 0)
+            if score > self.threshold:
+                flags.append(key)
+                detected_issues[key] = {"score": score}
+                severity = self._escalate_severity(severity, key_severity)
         
+        return severity, llm_result.get("confidence", 0.8)
+    
+    def build_result(
+        self,
+        flags: list,
+        severity: str,
+        confidence: float,
+        detected_issues: dict
+    ) -> dict:
+        """Assemble the final moderation result"""
         # Determine if appropriate
         is_appropriate = len(flags) == 0
         
@@ -117,8 +279,12 @@ class ModerationService:
     
     def _check_profanity(self, text: str) -> dict:
         """Fast local profanity check"""
-        contains = profanity.contains_profanity(text)
-        censored = profanity.censor(text) if contains else text
+        if self._may_contain_profanity(text):
+            censored = profanity.censor(text)
+            contains = censored != text
+        else:
+            censored = text
+            contains = False
         
         return {
             "contains_profanity": contains,
@@ -126,18 +292,70 @@ class ModerationService:
             "method": "better-profanity"
         }
     
+    @staticmethod
+    def _substitution_classes(char_map: dict) -> dict:
+        """Map every character to a representative of its connected substitution class"""
+        parent = {}
+        
+        def find(char):
+            while parent.setdefault(char, char) != char:
+                char = parent[char]
+            return char
+        
+        for char, variants in char_map.items():
+            for variant in variants:
+                parent[find(variant)] = find(char)
+        
+        return {char: find(char) for char in parent}
+    
+    def _may_contain_profanity(self, text: str) -> bool:
+        """Cheap skeleton pre-check; False means better-profanity would censor nothing"""
+        words = [(m.group().lower(), m.start(), m.end()) for m in self._profanity_word.finditer(text)]
+        skeleton = self._profanity_skeleton
+        skeletons = self._profanity_skeletons
+        
+        for i, (word, _, end) in enumerate(words):
+            if word.translate(skeleton) in skeletons:
+                return True
+            
+            # Multi-word entries, joined directly or with the separators between them
+            joined = spaced = word
+            for next_word, next_start, next_end in words[i + 1:i + self._profanity_max_words]:
+                joined += next_word
+                spaced += text[end:next_start].lower() + next_word
+                end = next_end
+                if joined.translate(skeleton) in skeletons or spaced.translate(skeleton) in skeletons:
+                    return True
+        
+        return False
+    
     def _check_spam(self, text: str) -> dict:
         """Check for spam patterns"""
-        text_lower = text.lower()
         matches = []
         
-        for pattern in self.spam_patterns:
-            if re.search(pattern, text_lower, re.IGNORECASE):
-                matches.append(pattern)
+        # Trigger must follow a keyword on the same line (as `.` would require)
+        keyword = self.spam_keywords.search(text)
+        while keyword:
+            line_end = text.find("\n", keyword.end())
+            if line_end == -1:
+                line_end = len(text)
+            if self.spam_triggers.search(text, keyword.end(), line_end):
+                matches.append(self.spam_keyword_source)
+                break
+            keyword = self.spam_keywords.search(text, line_end + 1)
+        
+        for compiled, source in self.spam_patterns:
+            if compiled.search(text):
+                matches.append(source)
         
         # Check for excessive caps
         if len(text) > 10:
-            caps_ratio = sum(1 for c in text if c.isupper()) / len(text)
+            if text.isascii():
+                caps = len(text) - len(text.translate(_UPPER_STRIP))
+            else:
+                # Unicode capitals (accented, Greek, Cyrillic...) need isupper()
+                caps = sum(1 for c in text if c.isupper())
+            caps_ratio = caps / len(text)
             if caps_ratio > 0.5:
                 matches.append("excessive_caps")
         
@@ -149,6 +367,59 @@ class ModerationService:
     async def _llm_analysis(self, text: str, context: Optional[str] = None) -> dict:
         """Deep LLM analysis for nuanced content"""
         
+        cache_key = self._verdict_cache_key(text, context)
+        cached = self.cached_llm_result(text, context)
+        if cached is not None:
+            return cached
+        
+        context_key = " ".join((context or "").split()).lower()
+        embedding = None
+        if len(text) >= self.semantic_min_length:
+            embedding = await self._embed(text)
+            if embedding is not None:
+                similar = self._semantic_lookup(embedding, context_key)
+                if similar is not None:
+                    self.stats["semantic_hits"] += 1
+                    self._verdict_cache[cache_key] = similar
+                    return dict(similar)
+        
+        system_prompt, user_prompt = self._build_prompts(text, context)
+        
+        try:
+            scores = await self._invoke_llm([
+                SystemMessage(content=system_prompt),
+                HumanMessage(content=user_prompt)
+            ])
+            
+            result = scores.model_dump()
+            self._verdict_cache[cache_key] = result
+            if embedding is not None:
+                self._semantic_store(embedding, context_key, result)
+            return dict(result)
+        except Exception as e:
+            print(f"LLM analysis error: {e}")
+            return {
+                "toxicity": 0.0,
+                "harassment": 0.0,
+                "hate_speech": 0.0,
+                "inappropriate": 0.0,
+                "confidence": 0.5
+            }
+    
+    @retry(
+        retry=retry_if_exception_type((RateLimitError, APIConnectionError, InternalServerError)),
+        wait=_wait_retry_after,
+        stop=stop_after_attempt(5),
+        reraise=True
+    )
+    async def _invoke_llm(self, messages: list) -> ModerationScores:
+        """Structured LLM call, retried on rate limits and transient API errors.
+        The concurrency slot is held per attempt, not across backoff waits."""
+        async with self._llm_sem:
+            return await self.structured_llm.ainvoke(messages)
+    
+    def _build_prompts(self, text: str, context: Optional[str] = None) -> tuple[str, str]:
+        """Build the (system, user) prompt pair for LLM analysis"""
         system_prompt = """You are a content moderation expert for a university event platform.
 Analyze the following comment and rate it on these dimensions (0.0 to 1.0):
 
@@ -162,46 +433,90 @@ Consider context: This is a university event feedback system. Students and staff
 
 Respond ONLY with a JSON object containing the scores."""
 
-        user_prompt = f"""Analyze this comment:
-"{text}"
+        # Static instructions first and the comment last, so the shared prefix
+        # is as long as possible for OpenAI prompt caching
+        user_prompt = f"""Return JSON with toxicity, harassment, hate_speech, inappropriate, and confidence scores (0.0-1.0).
 
 {f'Context: {context}' if context else ''}
 
-Return JSON with toxicity, harassment, hate_speech, inappropriate, and confidence scores (0.0-1.0)."""
-
+Analyze this comment:
+"{text}\""""
+        
+        return system_prompt, user_prompt
+    
+    def batch_request_body(self, text: str, context: Optional[str] = None) -> dict:
+        """Chat-completions request body for submitting a comment via the Batch API"""
+        system_prompt, user_prompt = self._build_prompts(text, context)
+        return {
+            "model": self.llm.model_name,
+            "temperature": 0,
+            "prompt_cache_key": self.prompt_cache_key,
+            "response_format": _MODERATION_RESPONSE_FORMAT,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ]
+        }
+    
+    def parse_llm_content(self, content: str) -> dict:
+        """Parse the structured JSON scores from an LLM reply"""
+        return ModerationScores.model_validate_json(content).model_dump()
+    
+    def cached_llm_result(self, text: str, context: Optional[str] = None) -> Optional[dict]:
+        """LLM scores previously computed for this comment and context, if cached"""
+        cached = self._verdict_cache.get(self._verdict_cache_key(text, context))
+        if cached is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return dict(cached)
+    
+    def store_llm_result(self, text: str, context: Optional[str], result: dict):
+        """Cache LLM scores obtained outside _llm_analysis (e.g. from the Batch API)"""
+        self._verdict_cache[self._verdict_cache_key(text, context)] = dict(result)
+    
+    def _verdict_cache_key(self, text: str, context: Optional[str]) -> str:
+        """Hash of the whitespace/case-normalized comment and context"""
+        normalized_text = " ".join(text.split()).lower()
+        normalized_context = " ".join((context or "").split()).lower()
+        return hashlib.sha256(f"{normalized_text}\x00{normalized_context}".encode()).hexdigest()
+    
+    async def _embed(self, text: str) -> Optional[np.ndarray]:
+        """Unit-normalized embedding of a comment, or None if embedding fails"""
         try:
-            response = await self.llm.ainvoke([
-                SystemMessage(content=system_prompt),
-                HumanMessage(content=user_prompt)
-            ])
-            
-            # Parse response
-            import json
-            content = response.content.strip()
-            # Handle markdown code blocks
-            if content.startswith("```"):
-                content = content.split("```")[1]
-                if content.startswith("json"):
-                    content = content[4:]
-            
-            result = json.loads(content)
-            return result
+            vector = np.asarray(await self.embeddings.aembed_query(text), dtype=np.float32)
         except Exception as e:
-            print(f"LLM analysis error: {e}")
-            return {
-                "toxicity": 0.0,
-                "harassment": 0.0,
-                "hate_speech": 0.0,
-                "inappropriate": 0.0,
-                "confidence": 0.5
-            }
+            print(f"Embedding error: {e}")
+            return None
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+    
+    def _semantic_lookup(self, embedding: np.ndarray, context_key: str) -> Optional[dict]:
+        """Return the cached verdict of the most similar comment above threshold"""
+        if not self._semantic_entries:
+            return None
+        scores = self._semantic_vectors[:len(self._semantic_entries)] @ embedding
+        best = int(np.argmax(scores))
+        cached_context, verdict = self._semantic_entries[best]
+        if scores[best] >= self.semantic_threshold and cached_context == context_key:
+            return verdict
+        return None
+    
+    def _semantic_store(self, embedding: np.ndarray, context_key: str, verdict: dict) -> None:
+        """Add a verdict to the semantic cache, overwriting the oldest when full"""
+        if self._semantic_vectors is None:
+            self._semantic_vectors = np.empty((self._semantic_capacity, embedding.shape[0]), dtype=np.float32)
+        slot = self._semantic_next
+        self._semantic_vectors[slot] = embedding
+        if slot < len(self._semantic_entries):
+            self._semantic_entries[slot] = (context_key, verdict)
+        else:
+            self._semantic_entries.append((context_key, verdict))
+        self._semantic_next = (slot + 1) % self._semantic_capacity
     
     def _escalate_severity(self, current: str, new: str) -> str:
         """Escalate severity level"""
-        levels = ["none", "low", "medium", "high", "critical"]
-        current_idx = levels.index(current)
-        new_idx = levels.index(new)
-        return levels[max(current_idx, new_idx)]
+        return _SEVERITY_LEVELS[max(_SEVERITY_RANK[current], _SEVERITY_RANK[new])]
     
     def _generate_suggestion(self, flags: list, severity: str) -> Optional[str]:
         """Generate action suggestion based on flags and severity"""
@@ -225,15 +540,32 @@ Return JSON with toxicity, harassment, hate_speech, inappropriate, and confidenc
         event_id: Optional[str] = None
     ) -> dict:
         """Moderate multiple comments efficiently"""
+        # Fan out concurrently; _invoke_llm bounds the actual OpenAI calls
+        outcomes = await asyncio.gather(
+            *[
+                self.moderate_comment(
+                    comment=c.get("text", ""),
+                    comment_id=c.get("id"),
+                    event_id=event_id
+                )
+                for c in comments
+            ],
+            return_exceptions=True
+        )
+        
         results = []
         flagged_count = 0
+        failed_count = 0
         
-        for comment_data in comments:
-            result = await self.moderate_comment(
-                comment=comment_data.get("text", ""),
-                comment_id=comment_data.get("id"),
-                event_id=event_id
-            )
+        for comment_data, result in zip(comments, outcomes):
+            if isinstance(result, BaseException):
+                print(f"Batch moderation error for comment {comment_data.get('id')}: {result}")
+                failed_count += 1
+                results.append({
+                    "id": comment_data.get("id"),
+                    "error": str(result)
+                })
+                continue
             
             results.append({
                 "id": comment_data.get("id"),
@@ -246,6 +578,7 @@ Return JSON with toxicity, harassment, hate_speech, inappropriate, and confidenc
         return {
             "total": len(comments),
             "flagged": flagged_count,
+            "failed": failed_count,
             "results": results
         }
     
@@ -260,20 +593,16 @@ Return JSON with toxicity, harassment, hate_speech, inappropriate, and confidenc
         llm_result = await self._llm_analysis(text)
         
         # Determine sentiment
-        if llm_result.get("toxicity", 0) < 0.3:
+        toxicity = llm_result.get("toxicity", 0)
+        if toxicity < 0.3:
             sentiment = "positive" if len(text) < 50 else "neutral"
-        elif llm_result.get("toxicity", 0) < 0.6:
+        elif toxicity < 0.6:
             sentiment = "neutral"
         else:
             sentiment = "negative"
         
         # Calculate toxicity score (weighted average)
-        toxicity_score = (
-            llm_result.get("toxicity", 0) * 0.3 +
-            llm_result.get("harassment", 0) * 0.3 +
-            llm_result.get("hate_speech", 0) * 0.25 +
-            llm_result.get("inappropriate", 0) * 0.15
-        )
+        toxicity_score = sum(llm_result.get(key, 0) * weight for key, weight in _TOXICITY_WEIGHTS)
         
         summary = self._generate_analysis_summary(llm_result, sentiment)
         
@@ -302,6 +631,12 @@ Return JSON with toxicity, harassment, hate_speech, inappropriate, and confidenc
         
         return f"Content flagged for: {', '.join(issues)}. Overall sentiment: {sentiment}."
     
+    async def warmup(self) -> None:
+        """Prime the profanity gate and the OpenAI connection / prompt cache"""
+        self._check_profanity("hello world")
+        if os.getenv("OPENAI_API_KEY"):
+            await self._llm_analysis("hello world")
+    
     async def get_stats(self, event_id: Optional[str] = None) -> dict:
         """Get moderation statistics (placeholder for database integration)"""
         return {
@@ -314,6 +649,7 @@ Return JSON with toxicity, harassment, hate_speech, inappropriate, and confidenc
                 "low": 0
             },
             "common_flags": [],
+            "llm_cache": dict(self.stats),
             "event_id": event_id
         }
     
@@ -6,13 +6,66 @@ and processes them through AI moderation.
 """
 
 import os
+import sys
+import queue
 import asyncio
+import logging
 import httpx
+import orjson
+from collections import defaultdict
+from logging.handlers import QueueHandler, QueueListener
 from typing import Optional
-from datetime import datetime
+from openai import AsyncOpenAI
+from cachetools import LRUCache
 
 from services.moderation_service import ModerationService
 
+# Log records are handed to a queue and written to stdout by a listener thread,
+# so the polling loop never blocks the event loop on console I/O
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.propagate = False
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+logger.addHandler(QueueHandler(_log_queue))
+_log_stream = logging.StreamHandler(sys.stdout)
+_log_stream.setFormatter(logging.Formatter("[%(asctime)s] %(message)s", datefmt="%H:%M:%S"))
+_log_listener = QueueListener(_log_queue, _log_stream)
+
+# Batch API statuses after which a batch will not change any more
+_BATCH_TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def _comment_context(comment: dict) -> str:
+    """Moderation context string for a polled comment"""
+    return f"Event: {comment.get('eventName', 'Unknown')}"
+
+
+def _result_row(comment: dict, moderation_result: dict, flagged_log: list[str]) -> dict:
+    """Build the batch-moderation payload entry for one comment, noting flagged
+    comments in flagged_log so a tick's flags are logged in a single record"""
+    # Determine AI suggestion
+    ai_suggestion = "approve" if moderation_result["is_appropriate"] else "remove"
+    
+    # Generate reasoning
+    ai_reasoning = None
+    if moderation_result["flags"]:
+        ai_reasoning = f"Detected issues: {', '.join(moderation_result['flags'])}. {moderation_result.get('suggestion', '')}"
+    
+    # Collect flagged comments for logging
+    if not moderation_result["is_appropriate"] and logger.isEnabledFor(logging.INFO):
+        flagged_log.append(f"  🚩 Flagged: '{comment['content'][:50]}...' - {moderation_result['severity']} ({', '.join(moderation_result['flags'])})")
+    
+    return {
+        "feedbackId": comment["id"],
+        "isAppropriate": moderation_result["is_appropriate"],
+        "flags": list(moderation_result["flags"]),
+        "severity": moderation_result["severity"],
+        "confidence": moderation_result["confidence"],
+        "aiSuggestion": ai_suggestion,
+        "aiReasoning": ai_reasoning,
+    }
+
+
 class PollingService:
     """Service for polling and processing unmoderated comments"""
     
@@ -23,120 +76,359 @@ class PollingService:
         self.moderation_service = ModerationService()
         self._running = False
         self._task: Optional[asyncio.Task] = None
+        self._warmup_task: Optional[asyncio.Task] = None
+        # Shared HTTP client so the connection pool survives across poll cycles
+        self._client: Optional[httpx.AsyncClient] = None
+        # Route the LLM layer of polled comments through the (cheaper, slower) Batch API
+        self.use_batch_api = os.getenv("MODERATION_USE_BATCH_API", "false").lower() == "true"
+        self._openai: Optional[AsyncOpenAI] = None
+        # batch id -> feedback id -> {"comment", "local"} awaiting Batch API output
+        self._pending_batches: dict[str, dict[str, dict]] = {}
+        # batch id -> OpenAI file ids (input/output/error) to delete once it's done
+        self._batch_files: dict[str, list[str]] = {}
+        # feedback id -> content of comments whose results the backend saved. The
+        # backend keeps returning approved comments (their flags stay empty), so
+        # this is how a tick tells new comments from ones it already handled
+        self._saved_comments = LRUCache(maxsize=10_000)
         
     async def start(self):
         """Start the background polling task"""
         if self._running:
-            print("⚠️ Polling service already running")
+            logger.warning("⚠️ Polling service already running")
             return
             
         self._running = True
+        _log_listener.start()
+        self._client = httpx.AsyncClient(
+            timeout=30.0,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+            http2=True
+        )
+        if self.use_batch_api:
+            self._openai = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
         self._task = asyncio.create_task(self._poll_loop())
-        print(f"🔄 Moderation polling service started (interval: {self.poll_interval}s)")
+        # Warm connections concurrently with the first poll
+        self._warmup_task = asyncio.create_task(self.warmup())
+        logger.info("🔄 Moderation polling service started (interval: %ds)", self.poll_interval)
         
     async def stop(self):
         """Stop the background polling task"""
+        was_running = self._running
         self._running = False
+        if self._warmup_task and not self._warmup_task.done():
+            self._warmup_task.cancel()
         if self._task:
             self._task.cancel()
             try:
                 await self._task
             except asyncio.CancelledError:
                 pass
-        print("⏹️ Moderation polling service stopped")
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+        if self._openai:
+            await self._openai.close()
+            self._openai = None
+        logger.info("⏹️ Moderation polling service stopped")
+        if was_running:
+            _log_listener.stop()
+        
+    async def warmup(self):
+        """Open connections to the backend and OpenAI ahead of the first real use"""
+        try:
+            await self._client.head(f"{self.backend_url}/health")
+        except httpx.RequestError as e:
+            logger.warning("⚠️ Backend warmup failed: %s", e)
+        try:
+            await self.moderation_service.warmup()
+        except Exception as e:
+            logger.warning("⚠️ Moderation warmup failed: %s", e)
         
     async def _poll_loop(self):
         """Main polling loop"""
+        loop = asyncio.get_running_loop()
         while self._running:
+            # Deadline-based so processing time doesn't stretch the poll cadence
+            next_tick = loop.time() + self.poll_interval
+            backlog = 0
             try:
-                await self._process_unmoderated_comments()
+                backlog = await self._process_unmoderated_comments()
             except Exception as e:
-                print(f"❌ Polling error: {e}")
+                logger.error("❌ Polling error: %s", e)
+            
+            # Drain a backlog right away; the floor avoids a busy loop on misconfiguration
+            if backlog > 0:
+                await asyncio.sleep(0.1)
+                continue
             
             # Wait for next poll interval
-            await asyncio.sleep(self.poll_interval)
+            await asyncio.sleep(max(0.1, next_tick - loop.time()))
     
-    async def _process_unmoderated_comments(self):
-        """Fetch and process unmoderated comments"""
-        print(f"\n🔍 [{datetime.now().strftime('%H:%M:%S')}] Checking for unmoderated comments...")
+    async def _process_unmoderated_comments(self) -> int:
+        """Fetch and process unmoderated comments.
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            try:
-                # Fetch unmoderated comments from backend
-                # Using a direct REST endpoint instead of tRPC for simplicity
-                response = await client.get(
-                    f"{self.backend_url}/api/feedback/unmoderated",
-                    params={"limit": self.batch_size}
+        Returns the number of comments still pending beyond this batch that
+        can be processed immediately (0 when the loop should wait).
+        """
+        logger.info("🔍 Checking for unmoderated comments...")
+        
+        client = self._client
+        # Comments waiting on a batch are still unmoderated in the backend (which
+        # returns the newest first), so fetch past them to reach new comments
+        in_flight = {fid for pending in self._pending_batches.values() for fid in pending}
+        try:
+            # Fetch unmoderated comments from backend
+            # Using a direct REST endpoint instead of tRPC for simplicity
+            response = await client.get(
+                f"{self.backend_url}/api/feedback/unmoderated",
+                params={"limit": self.batch_size + len(in_flight)}
+            )
+            
+            if response.status_code != 200:
+                logger.warning("⚠️ Failed to fetch unmoderated comments: %s", response.status_code)
+                return 0
+            
+            data = orjson.loads(response.content)
+            comments = data.get("comments", [])
+            total = data.get("total", 0)
+            
+            if not comments:
+                logger.info("✅ No unmoderated comments found")
+                return 0
+            
+            logger.info("📝 Processing %d unmoderated comments (total pending: %d)", len(comments), total)
+            
+            # Only new (or edited) comments mean the backlog is actually shrinking;
+            # re-fetching already-saved ones must not trigger an immediate drain
+            has_new = any(
+                self._saved_comments.get(c["id"]) != c["content"]
+                for c in comments if c["id"] not in in_flight
+            )
+            
+            flagged_log: list[str] = []
+            finished_batches: list[str] = []
+            queued = 0
+            if self.use_batch_api:
+                results, finished_batches = await self._collect_batches(flagged_log)
+                local_results, queued = await self._moderate_via_batch(comments, in_flight, flagged_log)
+                results.extend(local_results)
+            else:
+                results = await self._moderate_realtime(comments, flagged_log)
+            if flagged_log:
+                logger.info("\n".join(flagged_log))
+            
+            # Send results back to backend
+            if results:
+                update_response = await client.post(
+                    f"{self.backend_url}/api/feedback/batch-moderation",
+                    content=orjson.dumps({"results": results}),
+                    headers={"content-type": "application/json"}
                 )
                 
-                if response.status_code != 200:
-                    print(f"⚠️ Failed to fetch unmoderated comments: {response.status_code}")
-                    return
-                
-                data = response.json()
-                comments = data.get("comments", [])
-                total = data.get("total", 0)
+                if update_response.status_code == 200:
+                    update_data = orjson.loads(update_response.content)
+                    logger.info("✅ Updated %s comments, %s failed", update_data.get('updated', 0), update_data.get('failed', 0))
+                else:
+                    logger.warning("⚠️ Failed to update moderation results: %s", update_response.status_code)
+                    return 0
                 
-                if not comments:
-                    print("✅ No unmoderated comments found")
-                    return
+                # The verdicts reached the backend; until now a failed POST left
+                # the finished batches tracked so their output is collected again
+                await self._forget_batches(finished_batches)
+                contents = {c["id"]: c["content"] for c in comments}
+                for row in results:
+                    if row["feedbackId"] in contents:
+                        self._saved_comments[row["feedbackId"]] = contents[row["feedbackId"]]
                 
-                print(f"📝 Processing {len(comments)} unmoderated comments (total pending: {total})")
-                
-                # Process each comment through moderation
-                results = []
-                for comment in comments:
-                    try:
-                        moderation_result = await self.moderation_service.moderate_comment(
-                            comment=comment["content"],
-                            comment_id=comment["id"],
-                            event_id=comment.get("eventId"),
-                            user_id=comment.get("userId"),
-                            context=f"Event: {comment.get('eventName', 'Unknown')}"
-                        )
-                        
-                        # Determine AI suggestion
-                        ai_suggestion = "approve" if moderation_result["is_appropriate"] else "remove"
-                        
-                        # Generate reasoning
-                        ai_reasoning = None
-                        if moderation_result["flags"]:
-                            ai_reasoning = f"Detected issues: {', '.join(moderation_result['flags'])}. {moderation_result.get('suggestion', '')}"
-                        
-                        results.append({
-                            "feedbackId": comment["id"],
-                            "isAppropriate": moderation_result["is_appropriate"],
-                            "flags": moderation_result["flags"],
-                            "severity": moderation_result["severity"],
-                            "confidence": moderation_result["confidence"],
-                            "aiSuggestion": ai_suggestion,
-                            "aiReasoning": ai_reasoning,
-                        })
-                        
-                        # Log flagged comments
-                        if not moderation_result["is_appropriate"]:
-                            print(f"  🚩 Flagged: '{comment['content'][:50]}...' - {moderation_result['severity']} ({', '.join(moderation_result['flags'])})")
-                        
-                    except Exception as e:
-                        print(f"  ❌ Error processing comment {comment['id']}: {e}")
-                
-                # Send results back to backend
-                if results:
-                    update_response = await client.post(
-                        f"{self.backend_url}/api/feedback/batch-moderation",
-                        json={"results": results}
-                    )
+                # Unsaved comments would just be fetched and moderated again,
+                # so back off to the normal cadence unless everything was saved
+                if update_data.get("updated", 0) != len(results):
+                    return 0
+            else:
+                await self._forget_batches(finished_batches)
+            
+            # Only drain when this tick handled new comments; otherwise the same
+            # comments would be fetched again right away
+            if not has_new or queued is None or not (results or queued):
+                return 0
+            return max(0, total - len(comments))
                     
-                    if update_response.status_code == 200:
-                        update_data = update_response.json()
-                        print(f"✅ Updated {update_data.get('updated', 0)} comments, {update_data.get('failed', 0)} failed")
-                    else:
-                        print(f"⚠️ Failed to update moderation results: {update_response.status_code}")
-                        
-            except httpx.RequestError as e:
-                print(f"❌ Network error: {e}")
+        except httpx.RequestError as e:
+            logger.error("❌ Network error: %s", e)
+        except Exception as e:
+            logger.error("❌ Unexpected error: %s", e)
+        return 0
+    
+    async def _moderate_realtime(self, comments: list[dict], flagged_log: list[str]) -> list[dict]:
+        """Moderate comments through all layers concurrently (the moderation
+        service bounds the LLM calls).
+        
+        Identical comments (same text and context, e.g. templated spam) are
+        moderated once and the verdict is shared by every comment in the group.
+        """
+        groups: dict[tuple[str, str], list[dict]] = defaultdict(list)
+        for comment in comments:
+            groups[(comment["content"], _comment_context(comment))].append(comment)
+        
+        async def _one(group: list[dict]) -> list[dict]:
+            comment = group[0]
+            try:
+                moderation_result = await self.moderation_service.moderate_comment(
+                    comment=comment["content"],
+                    comment_id=comment["id"],
+                    event_id=comment.get("eventId"),
+                    user_id=comment.get("userId"),
+                    context=_comment_context(comment)
+                )
+            except Exception as e:
+                logger.error("  ❌ Error processing comment %s: %s", comment['id'], e)
+                return []
+            return [_result_row(c, moderation_result, flagged_log) for c in group]
+        
+        outcomes = await asyncio.gather(*[_one(g) for g in groups.values()])
+        return [row for rows in outcomes for row in rows]
+    
+    async def _moderate_via_batch(
+        self,
+        comments: list[dict],
+        in_flight: set[str],
+        flagged_log: list[str]
+    ) -> tuple[list[dict], Optional[int]]:
+        """Run the local layers now and queue LLM analysis on the Batch API.
+        
+        Comments that don't need the LLM layer are returned immediately;
+        the rest are submitted as one batch and reported by _collect_batches
+        once OpenAI finishes it. Returns the local results and the number of
+        comments queued, or None if the batch could not be submitted (the
+        local results are still returned so they can be saved).
+        """
+        results = []
+        pending = []
+        
+        for comment in comments:
+            # Approved comments keep coming back from the backend; one that was
+            # saved and hasn't changed since would only be paid for again
+            if comment["id"] in in_flight or self._saved_comments.get(comment["id"]) == comment["content"]:
+                continue
+            flags, severity, detected_issues = self.moderation_service.run_local_layers(comment["content"])
+            confidence = 1.0
+            if self.moderation_service.needs_llm(comment["content"], flags):
+                llm_result = self.moderation_service.cached_llm_result(comment["content"], _comment_context(comment))
+                if llm_result is None:
+                    pending.append((comment, (flags, severity, detected_issues)))
+                    continue
+                severity, confidence = self.moderation_service.apply_llm_result(
+                    llm_result, flags, severity, detected_issues
+                )
+            moderation_result = self.moderation_service.build_result(flags, severity, confidence, detected_issues)
+            results.append(_result_row(comment, moderation_result, flagged_log))
+        
+        if pending:
+            try:
+                await self._submit_batch(pending)
             except Exception as e:
-                print(f"❌ Unexpected error: {e}")
+                logger.error("❌ Failed to submit moderation batch: %s", e)
+                return results, None
+        
+        return results, len(pending)
+    
+    async def _submit_batch(self, pending: list[tuple[dict, tuple]]):
+        """Upload a JSONL file of chat-completion requests and create a batch"""
+        lines = [
+            orjson.dumps({
+                "custom_id": comment["id"],
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": self.moderation_service.batch_request_body(comment["content"], _comment_context(comment))
+            })
+            for comment, _ in pending
+        ]
+        
+        batch_file = await self._openai.files.create(
+            file=("moderation.jsonl", b"\n".join(lines)),
+            purpose="batch"
+        )
+        batch = await self._openai.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        
+        self._batch_files[batch.id] = [batch_file.id]
+        self._pending_batches[batch.id] = {
+            comment["id"]: {"comment": comment, "local": local}
+            for comment, local in pending
+        }
+        logger.info("📦 Submitted %d comments for batch moderation (%s)", len(pending), batch.id)
+    
+    async def _collect_batches(self, flagged_log: list[str]) -> tuple[list[dict], list[str]]:
+        """Turn finished Batch API jobs into moderation results.
+        
+        Returns the results and the ids of the batches they came from. Those
+        batches stay tracked (so their comments aren't resubmitted) until the
+        caller has saved the results and calls _forget_batches.
+        """
+        results = []
+        finished = []
+        
+        for batch_id, pending in list(self._pending_batches.items()):
+            batch = await self._openai.batches.retrieve(batch_id)
+            if batch.status not in _BATCH_TERMINAL_STATUSES:
+                continue
+            
+            files = self._batch_files.setdefault(batch_id, [])
+            files.extend(
+                file_id for file_id in (batch.output_file_id, batch.error_file_id)
+                if file_id and file_id not in files
+            )
+            if batch.status != "completed" or not batch.output_file_id:
+                # Nothing to save: its comments become eligible for resubmission
+                logger.warning("⚠️ Moderation batch %s ended with status %s", batch_id, batch.status)
+                await self._forget_batches([batch_id])
+                continue
+            
+            finished.append(batch_id)
+            
+            output = await self._openai.files.content(batch.output_file_id)
+            for line in output.text.splitlines():
+                if not line.strip():
+                    continue
+                item = orjson.loads(line)
+                entry = pending.get(item.get("custom_id"))
+                response = item.get("response") or {}
+                if not entry or response.get("status_code") != 200:
+                    continue
+                
+                try:
+                    llm_result = self.moderation_service.parse_llm_content(
+                        response["body"]["choices"][0]["message"]["content"]
+                    )
+                except Exception as e:
+                    logger.error("  ❌ Error parsing batch result for comment %s: %s", entry['comment']['id'], e)
+                    continue
+                
+                self.moderation_service.store_llm_result(
+                    entry["comment"]["content"], _comment_context(entry["comment"]), llm_result
+                )
+                flags, severity, detected_issues = entry["local"]
+                severity, confidence = self.moderation_service.apply_llm_result(
+                    llm_result, flags, severity, detected_issues
+                )
+                moderation_result = self.moderation_service.build_result(flags, severity, confidence, detected_issues)
+                results.append(_result_row(entry["comment"], moderation_result, flagged_log))
+        
+        return results, finished
+    
+    async def _forget_batches(self, batch_ids: list[str]):
+        """Stop tracking batches whose results have been saved (any comment they
+        didn't answer becomes eligible for resubmission) and delete their files"""
+        for batch_id in batch_ids:
+            self._pending_batches.pop(batch_id, None)
+            for file_id in self._batch_files.pop(batch_id, []):
+                try:
+                    await self._openai.files.delete(file_id)
+                except Exception as e:
+                    logger.warning("⚠️ Failed to delete batch file %s: %s", file_id, e)
     
     async def process_single(self, comment_id: str, content: str, event_name: str = "Unknown"):
         """Process a single comment immediately (for real-time moderation)"""
@@ -148,7 +440,7 @@ class PollingService:
             )
             return result
         except Exception as e:
-            print(f"❌ Error processing single comment: {e}")
+            logger.error("❌ Error processing single comment: %s", e)
             return None
 
 
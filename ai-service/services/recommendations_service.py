@@ -8,19 +8,252 @@ AI-powered personalized event recommendations using:
 """
 
 import os
-from typing import Optional
-from langchain_openai import ChatOpenAI
+import re
+import sys
+import orjson
+import asyncio
+import heapq
+import hashlib
+import threading
+import traceback
+import httpx
+import numpy as np
+from typing import AsyncIterator, Callable, Optional
+from contextlib import aclosing
+from cachetools import TTLCache, LRUCache
+from rank_bm25 import BM25Okapi
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain.schema import HumanMessage, SystemMessage
+from openai import AsyncOpenAI, RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
+
+_BATCH_TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+_JSON_RESPONSE_FORMAT = {"type": "json_object"}
+
+# Events are sent as pipe-separated rows under a single column header, which
+# costs far fewer tokens than labeling every field of every event
+_EVENT_COLUMNS = "id|name|type|faculty|date|rating|desc"
+_EVENT_TMPL = "{}|{}|{}|{}|{}|{}|{}"
+_ROW_SAFE = str.maketrans({"|": "/", "\n": " ", "\r": " "})
+# Event contexts larger than this are built off the event loop
+_OFFLOAD_THRESHOLD = 50
+
+_TOKEN_RE = re.compile(r"\w+")
+_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$", re.M)
+# Characters that change nesting or string state in a streamed JSON reply
+_JSON_STRUCT_RE = re.compile(r'[\\"{}\[\]]')
+
+# Mirrors the INTEREST KEYWORD MATCHING table in the scoring prompt: an interest
+# naming a category (or one of its keywords) also matches the category's keywords
+_INTEREST_CATEGORIES = [
+    (
+        frozenset({"sport", "sports", "fitness", "athletics", "exercise"}),
+        frozenset({"gym", "fitness", "basketball", "football", "tournament", "sports", "wellness", "nutrition", "health"})
+    ),
+    (
+        frozenset({"tech", "technology", "computing", "computer", "engineering"}),
+        frozenset({"programming", "ai", "machine", "learning", "web", "hackathon", "coding", "software", "tech"})
+    ),
+    (
+        frozenset({"business", "management", "economics"}),
+        frozenset({"entrepreneurship", "startup", "business", "marketing", "finance", "networking"})
+    ),
+    (
+        frozenset({"art", "arts", "culture", "creative"}),
+        frozenset({"art", "design", "photography", "music", "theater", "creative", "exhibition"})
+    ),
+]
+
+def _interest_set(interests: list[str]) -> frozenset[str]:
+    """Lowercased word tokens of the user's interests, expanded with the keywords
+    of every category they name"""
+    tokens = frozenset(_TOKEN_RE.findall(" ".join(interests).lower()))
+    expanded = set(tokens)
+    for triggers, keywords in _INTEREST_CATEGORIES:
+        if tokens & (triggers | keywords):
+            expanded |= keywords
+    return frozenset(expanded)
+
+def _parse_batch_recommendations(content: str) -> list[dict]:
+    """Flatten a {"batches": {"1": [...], ...}} scoring reply into one list"""
+    batches = orjson.loads(_FENCE_RE.sub("", content).strip()).get("batches") or {}
+    return [
+        rec
+        for recs in batches.values() if isinstance(recs, list)
+        for rec in recs if isinstance(rec, dict)
+    ]
+
+class _RecommendationScanner:
+    """Incremental parser for a streamed {"batches": {"1": [{...}, ...]}} reply.
+    
+    feed() returns each recommendation object as soon as its closing brace
+    arrives, so scoring results are usable before generation finishes.
+    """
+    
+    def __init__(self):
+        self.text = ""
+        self.found = 0
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._start = -1
+    
+    def feed(self, chunk: str) -> list[dict]:
+        self.text += chunk
+        text = self.text
+        recommendations = []
+        for match in _JSON_STRUCT_RE.finditer(text, self._pos):
+            i = match.start()
+            if i < self._pos:
+                continue  # Escaped character
+            ch = match.group()
+            if self._in_string:
+                if ch == "\\":
+                    self._pos = i + 2
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                # Recommendations sit at root object > batches > batch list
+                if ch == "{" and self._depth == 3:
+                    self._start = i
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if ch == "}" and self._depth == 3 and self._start >= 0:
+                    try:
+                        rec = orjson.loads(text[self._start:i + 1])
+                    except orjson.JSONDecodeError:
+                        rec = None
+                    if isinstance(rec, dict):
+                        recommendations.append(rec)
+                    self._start = -1
+        self._pos = max(self._pos, len(text))
+        self.found += len(recommendations)
+        return recommendations
+
+def _llm_retrying() -> AsyncRetrying:
+    """Retry policy for OpenAI rate limits and transient connection errors"""
+    return AsyncRetrying(
+        stop=stop_after_attempt(4),
+        wait=wait_exponential_jitter(1, 16),
+        retry=retry_if_exception_type((RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)),
+        reraise=True
+    )
+
+class EventEmbeddingCache:
+    """Unit-normalized event embeddings cached by (event id, content hash)"""
+    
+    def __init__(self, embeddings: OpenAIEmbeddings, maxsize: int = 10_000):
+        self._embeddings = embeddings
+        self._vectors = LRUCache(maxsize=maxsize)
+    
+    @staticmethod
+    def _key(event: dict) -> tuple[tuple[str, bytes], str]:
+        text = f"{event.get('name', '')}\n{event.get('description', '')}"
+        digest = hashlib.blake2b(text.encode(), digest_size=16).digest()
+        return (str(event.get("id")), digest), text
+    
+    async def matrix(self, events: list[dict]) -> np.ndarray:
+        """Return an (n, dim) float16 matrix of embeddings, embedding only uncached events"""
+        keys = [self._key(e) for e in events]
+        vectors = {key: self._vectors[key] for key, _ in keys if key in self._vectors}
+        
+        missing = {key: text for key, text in keys if key not in vectors}
+        if missing:
+            embedded = np.asarray(
+                await self._embeddings.aembed_documents(list(missing.values())),
+                dtype=np.float32
+            )
+            embedded /= np.linalg.norm(embedded, axis=1, keepdims=True)
+            for key, vector in zip(missing, embedded.astype(np.float16)):
+                self._vectors[key] = vectors[key] = vector
+        
+        return np.stack([vectors[key] for key, _ in keys])
 
 class RecommendationsService:
     """Service for AI-powered event recommendations"""
     
     def __init__(self):
+        # Shared HTTP/2 client so concurrent batch requests multiplex over
+        # pooled connections instead of paying a TLS handshake each
+        self._http = httpx.AsyncClient(
+            timeout=60.0,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+            http2=True
+        )
         self.llm = ChatOpenAI(
             model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
             temperature=0.3,
-            api_key=os.getenv("OPENAI_API_KEY")
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_async_client=self._http,
+            max_retries=0  # Retries are handled by _ainvoke
         )
+        # JSON mode keeps replies to a single JSON object
+        self.json_llm = self.llm.bind(response_format=_JSON_RESPONSE_FORMAT)
+        # Caps concurrent LLM calls to stay within OpenAI rate limits
+        self._sem = asyncio.Semaphore(int(os.getenv("LLM_MAX_CONCURRENCY", "8")))
+        # Batch results keyed by a hash of user context + events context. No lock
+        # is needed: lookups and stores never straddle an await.
+        self._batch_cache = TTLCache(maxsize=2048, ttl=900)
+        # Event embeddings are computed once per (id, content) and reused
+        self._event_embeddings = EventEmbeddingCache(OpenAIEmbeddings(
+            model=os.getenv("RECOMMENDATIONS_EMBEDDING_MODEL", "text-embedding-3-small"),
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_async_client=self._http
+        ))
+        # Only the best keyword matches are sent to the LLM for scoring
+        self.prefilter_top_k = int(os.getenv("RECOMMENDATIONS_PREFILTER_TOP_K", "30"))
+        # Formatted event rows keyed by the fields they render, so edited
+        # events get a fresh entry
+        self._event_ctx_cache = LRUCache(maxsize=10_000)
+        # Rows may be built in worker threads (see _OFFLOAD_THRESHOLD)
+        self._event_ctx_lock = threading.Lock()
+        # Tokenized name + description per event, shared by the BM25 prefilter
+        # and the prior score
+        self._event_token_cache = LRUCache(maxsize=10_000)
+        # Batches of 20 events packed into one request (keeps context under ~8k tokens)
+        self.batches_per_request = 4
+    
+    async def _ainvoke(self, messages: list, json_mode: bool = False):
+        """Rate-limited LLM call, retried on 429s and transient connection errors"""
+        llm = self.json_llm if json_mode else self.llm
+        async with self._sem:
+            async for attempt in _llm_retrying():
+                with attempt:
+                    return await llm.ainvoke(messages)
+    
+    async def _astream_recommendations(
+        self,
+        messages: list,
+        on_recommendation: Optional[Callable[[dict], None]] = None
+    ) -> list[dict]:
+        """Rate-limited streaming scoring call. Each recommendation is passed to
+        on_recommendation as soon as it is parsed; retries (as in _ainvoke) skip
+        events that were already passed on."""
+        recommendations = []
+        seen = set()
+        
+        def _emit(recs: list[dict]):
+            for rec in recs:
+                if rec.get("event_id") in seen:
+                    continue
+                seen.add(rec.get("event_id"))
+                recommendations.append(rec)
+                if on_recommendation:
+                    on_recommendation(rec)
+        
+        async with self._sem:
+            async for attempt in _llm_retrying():
+                with attempt:
+                    scanner = _RecommendationScanner()
+                    async for chunk in self.json_llm.astream(messages):
+                        _emit(scanner.feed(chunk.content))
+                    if not scanner.found and scanner.text.strip():
+                        # Unexpected layout: fall back to parsing the whole reply
+                        _emit(_parse_batch_recommendations(scanner.text))
+        return recommendations
     
     async def get_personalized_recommendations(
         self,
@@ -40,19 +273,7 @@ class RecommendationsService:
                 "personalization_factors": []
             }
         
-        # Extract registered event IDs
-        registered_ids = set()
-        if registration_history and registration_history.get("event_ids"):
-            registered_ids = set(registration_history["event_ids"])
-        
-        # Filter out registered events if requested
-        # Note: GYM_SESSION events are already filtered at the backend level
-        candidate_events = available_events
-        if exclude_registered:
-            candidate_events = [
-                e for e in available_events 
-                if e.get("id") not in registered_ids
-            ]
+        candidate_events = self._candidate_events(available_events, registration_history, exclude_registered)
         
         if not candidate_events:
             return {
@@ -61,47 +282,208 @@ class RecommendationsService:
                 "personalization_factors": []
             }
         
+        # Rank locally by interest keywords; the LLM only re-ranks the top matches
+        total_candidates = len(candidate_events)
+        interest_set = _interest_set(user_profile.get("interests") or [])
+        candidate_events = self._prefilter_candidates(candidate_events, interest_set)
+        
         # Build user context for AI
         user_context = self._build_user_context(user_profile, registration_history, favorite_event_ids)
         
-        # Process ALL events in batches of 20 for better token efficiency
-        # This allows us to analyze hundreds of events while managing context size
-        batch_size = 20
+        # Most promising events go into the earliest requests
+        candidate_events = sorted(
+            candidate_events,
+            key=lambda e: self._prior_score(e, user_profile.get("faculty"), interest_set),
+            reverse=True
+        )
+        
         all_recommendations = []
+        strong_matches = 0
+        groups = self._batch_groups(candidate_events)
+        
+        print(f"[RECOMMENDATIONS] Dispatching {len(candidate_events)} events in {len(groups)} concurrent requests")
+        async with aclosing(self._stream_recommendations(user_context, groups)) as recommendations:
+            async for rec in recommendations:
+                all_recommendations.append(rec)
+                strong_matches += rec.get("score", 0) >= 90
+                # Plenty of strong matches already: the rest of the generation
+                # is unlikely to change the top results
+                if strong_matches >= limit * 2:
+                    print(f"[RECOMMENDATIONS] Found {strong_matches} strong matches, skipping remaining requests")
+                    break
+        
+        return self._rank_and_enrich(all_recommendations, candidate_events, total_candidates, limit)
+    
+    async def get_personalized_recommendations_batched(
+        self,
+        users: list[dict],
+        available_events: list[dict],
+        limit: int = 10,
+        exclude_registered: bool = True,
+        poll_interval: float = 30.0,
+        max_poll_interval: float = 600.0
+    ) -> dict[str, dict]:
+        """Generate recommendations for many users through OpenAI's Batch API.
         
-        print(f"[RECOMMENDATIONS] Processing {len(candidate_events)} events in batches of {batch_size}")
+        Meant for scheduled jobs (e.g. daily digests) that can wait for the
+        batch to finish: tokens cost about half the real-time price and the
+        requests don't count against the chat endpoint's rate limits. Each
+        user is a dict with `user_profile` and optional `registration_history`
+        and `favorite_event_ids`, as for get_personalized_recommendations.
+        Returns the same result dict per user, keyed by user_id.
+        """
+        results = {}
+        jobs = {}
+        lines = []
         
-        # Process events in batches
-        for batch_start in range(0, len(candidate_events), batch_size):
-            batch_end = min(batch_start + batch_size, len(candidate_events))
-            batch_events = candidate_events[batch_start:batch_end]
+        for user in users:
+            user_profile = user["user_profile"]
+            user_id = str(user_profile["user_id"])
+            registration_history = user.get("registration_history")
+            candidate_events = self._candidate_events(available_events, registration_history, exclude_registered)
+            if not candidate_events:
+                results[user_id] = {
+                    "recommendations": [],
+                    "reasoning": "No new events available (you may already be registered for all)",
+                    "personalization_factors": []
+                }
+                continue
             
-            print(f"[RECOMMENDATIONS] Processing batch {batch_start//batch_size + 1}: events {batch_start} to {batch_end}")
+            total_candidates = len(candidate_events)
+            candidate_events = self._prefilter_candidates(
+                candidate_events,
+                _interest_set(user_profile.get("interests") or [])
+            )
+            user_context = self._build_user_context(
+                user_profile, registration_history, user.get("favorite_event_ids")
+            )
+            jobs[user_id] = (candidate_events, total_candidates, [])
             
-            events_context = self._build_events_context(batch_events)
-            batch_recommendations = await self._get_batch_recommendations(
-                user_context=user_context,
-                events_context=events_context,
-                events_to_process=batch_events,
-                limit=limit,
-                batch_number=batch_start//batch_size + 1,
-                total_batches=(len(candidate_events) + batch_size - 1) // batch_size
+            groups = self._batch_groups(candidate_events)
+            for request_number, group in enumerate(groups, start=1):
+                system_prompt, user_prompt = self._recommendation_prompts(
+                    user_context, self._build_batches_context(group), group, request_number, len(groups)
+                )
+                lines.append(orjson.dumps({
+                    "custom_id": f"{user_id}:{request_number}",
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {
+                        "model": self.llm.model_name,
+                        "temperature": self.llm.temperature,
+                        "response_format": _JSON_RESPONSE_FORMAT,
+                        "messages": [
+                            {"role": "system", "content": system_prompt},
+                            {"role": "user", "content": user_prompt}
+                        ]
+                    }
+                }))
+        
+        if not lines:
+            return results
+        
+        client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        try:
+            batch_file = await client.files.create(
+                file=("recommendations.jsonl", b"\n".join(lines)),
+                purpose="batch"
             )
+            batch = await client.batches.create(
+                input_file_id=batch_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h"
+            )
+            print(f"[RECOMMENDATIONS] Submitted {len(lines)} requests for {len(jobs)} users as batch {batch.id}")
+            
+            delay = poll_interval
+            while batch.status not in _BATCH_TERMINAL_STATUSES:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, max_poll_interval)
+                batch = await client.batches.retrieve(batch.id)
             
-            all_recommendations.extend(batch_recommendations)
+            if batch.status != "completed" or not batch.output_file_id:
+                raise Exception(f"Recommendation batch {batch.id} ended with status {batch.status}")
+            
+            output = await client.files.content(batch.output_file_id)
+        finally:
+            await client.close()
+        
+        for line in output.text.splitlines():
+            if not line.strip():
+                continue
+            item = orjson.loads(line)
+            user_id = item["custom_id"].rsplit(":", 1)[0]
+            response = item.get("response") or {}
+            if user_id not in jobs or response.get("status_code") != 200:
+                print(f"[RECOMMENDATIONS] Batch request {item['custom_id']} failed: {item.get('error')}")
+                continue
+            try:
+                jobs[user_id][2].extend(_parse_batch_recommendations(
+                    response["body"]["choices"][0]["message"]["content"]
+                ))
+            except (ValueError, KeyError, IndexError, AttributeError) as e:
+                print(f"[RECOMMENDATIONS] Batch request {item['custom_id']} returned unusable output: {e}")
         
-        # Sort all recommendations by score and take top limit
-        all_recommendations.sort(key=lambda x: x.get("score", 0), reverse=True)
-        top_recommendations = all_recommendations[:limit]
+        for user_id, (candidate_events, total_candidates, recommendations) in jobs.items():
+            results[user_id] = self._rank_and_enrich(recommendations, candidate_events, total_candidates, limit)
+        
+        return results
+    
+    def _candidate_events(
+        self,
+        available_events: list[dict],
+        registration_history: Optional[dict],
+        exclude_registered: bool
+    ) -> list[dict]:
+        """Events the user could still register for"""
+        # Extract registered event IDs
+        registered_ids = set()
+        if registration_history and registration_history.get("event_ids"):
+            registered_ids = set(registration_history["event_ids"])
+        
+        # Filter out registered events if requested; with nothing to exclude the
+        # list is shared as-is (callers never mutate it)
+        # Note: GYM_SESSION events are already filtered at the backend level
+        if not exclude_registered or not registered_ids:
+            return available_events
+        get = dict.get
+        return [
+            e for e in available_events 
+            if get(e, "id") not in registered_ids
+        ]
+    
+    def _batch_groups(self, candidate_events: list[dict]) -> list[list[list[dict]]]:
+        """Split events into batches of 20 for better token efficiency, packing up to
+        `batches_per_request` batches into each LLM request so the system prompt and
+        user context are paid once per request, not per batch"""
+        batch_size = 20
+        batches = [
+            candidate_events[i:i + batch_size]
+            for i in range(0, len(candidate_events), batch_size)
+        ]
+        return [
+            batches[i:i + self.batches_per_request]
+            for i in range(0, len(batches), self.batches_per_request)
+        ]
+    
+    def _rank_and_enrich(
+        self,
+        all_recommendations: list[dict],
+        candidate_events: list[dict],
+        total_candidates: int,
+        limit: int
+    ) -> dict:
+        """Sort recommendations globally, keep the top `limit` and attach full event data"""
+        # Take the top limit recommendations by score
+        top_recommendations = heapq.nlargest(limit, all_recommendations, key=lambda x: x.get("score", 0))
         
         print(f"[RECOMMENDATIONS] Collected {len(all_recommendations)} recommendations across all batches, returning top {len(top_recommendations)}")
         
         # Enrich recommendations with full event data
+        by_id = {e.get("id"): e for e in candidate_events}
         enriched_recs = []
         for rec in top_recommendations:
-            event_id = rec.get("event_id")
-            # Search in all candidate events
-            event_data = next((e for e in candidate_events if e.get("id") == event_id), None)
+            event_data = by_id.get(rec.get("event_id"))
             if event_data:
                 enriched_recs.append({
                     **event_data,
@@ -113,23 +495,154 @@ class RecommendationsService:
         
         return {
             "recommendations": enriched_recs,
-            "reasoning": f"Analyzed {len(candidate_events)} events and found {len(all_recommendations)} matches. Showing top {len(enriched_recs)} recommendations.",
+            "reasoning": f"Analyzed {total_candidates} events and found {len(all_recommendations)} matches. Showing top {len(enriched_recs)} recommendations.",
             "personalization_factors": ["interests", "past_behavior", "quality"]
         }
     
-    async def _get_batch_recommendations(
+    def _event_tokens(self, event: dict) -> tuple[list[str], frozenset[str]]:
+        """Word tokens of an event's name + description, as a list (for BM25) and a
+        set (for interest lookups), tokenized once per event content"""
+        key = (event.get("id"), event.get("name", ""), event.get("description", ""))
+        cached = self._event_token_cache.get(key)
+        if cached is None:
+            tokens = _TOKEN_RE.findall(f"{key[1]} {key[2]}".lower())
+            cached = self._event_token_cache[key] = (tokens, frozenset(tokens))
+        return cached
+    
+    def _prior_score(self, event: dict, faculty: Optional[str], interest_set: frozenset[str]) -> float:
+        """Cheap local estimate of how well an event suits a user: faculty match,
+        interest keywords in the name/description, and rating"""
+        faculty_match = bool(faculty) and event.get("faculty") == faculty
+        interest_hits = len(interest_set & self._event_tokens(event)[1])
+        return faculty_match * 20 + interest_hits * 10 + (event.get("averageRating") or 0)
+    
+    def _prefilter_candidates(self, candidates: list[dict], interest_set: frozenset[str]) -> list[dict]:
+        """Keep the top-K candidates by BM25 relevance of name + description to the user's interests"""
+        if not interest_set or len(candidates) <= self.prefilter_top_k:
+            return candidates
+        
+        corpus = [self._event_tokens(e)[0] for e in candidates]
+        scores = BM25Okapi(corpus).get_scores(list(interest_set))
+        
+        # With too few keyword matches the cut would keep an arbitrary slice of
+        # unmatched events, so leave every candidate to the LLM
+        if int((scores > 0).sum()) < self.prefilter_top_k:
+            return candidates
+        
+        # Stable sort keeps the original order among equally relevant events
+        ranked = sorted(range(len(candidates)), key=scores.__getitem__, reverse=True)
+        return [candidates[i] for i in ranked[:self.prefilter_top_k]]
+    
+    async def _stream_recommendations(
         self,
         user_context: str,
-        events_context: str,
-        events_to_process: list[dict],
-        limit: int,
-        batch_number: int,
-        total_batches: int
+        groups: list[list[list[dict]]]
+    ) -> AsyncIterator[dict]:
+        """Yield recommendations from all scoring requests, which run
+        concurrently, as each one is parsed. Closing the generator cancels the
+        requests still running."""
+        queue: asyncio.Queue = asyncio.Queue()
+        
+        async def _request(request_number: int, group: list[list[dict]]):
+            try:
+                await self._get_multibatch_recommendations(
+                    user_context=user_context,
+                    batches=group,
+                    request_number=request_number,
+                    total_requests=len(groups),
+                    on_recommendation=queue.put_nowait
+                )
+            finally:
+                queue.put_nowait(None)  # Request finished
+        
+        tasks = [
+            asyncio.create_task(_request(request_number, group))
+            for request_number, group in enumerate(groups, start=1)
+        ]
+        try:
+            running = len(tasks)
+            while running:
+                rec = await queue.get()
+                if rec is None:
+                    running -= 1
+                else:
+                    yield rec
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    async def _get_multibatch_recommendations(
+        self,
+        user_context: str,
+        batches: list[list[dict]],
+        request_number: int,
+        total_requests: int,
+        on_recommendation: Optional[Callable[[dict], None]] = None
     ) -> list[dict]:
-        """Process a single batch of events and return scored recommendations"""
+        """Score several labeled event batches in one LLM request and return the
+        merged recommendations, also passing each to on_recommendation as it arrives"""
+        
+        events_to_process = [e for batch in batches for e in batch]
+        if len(events_to_process) > _OFFLOAD_THRESHOLD:
+            # Build large contexts in a worker thread so other requests keep running
+            events_context = await asyncio.to_thread(self._build_batches_context, batches)
+        else:
+            events_context = self._build_batches_context(batches)
+        
+        # Event versions are part of the key so edited events are re-scored
+        versions = "\x00".join(str(e.get("updatedAt", "")) for e in events_to_process)
+        cache_key = hashlib.blake2b(
+            f"{user_context}\x00{events_context}\x00{versions}".encode(),
+            digest_size=16
+        ).digest()
+        cached = self._batch_cache.get(cache_key)
+        if cached is not None:
+            if on_recommendation:
+                for rec in cached:
+                    on_recommendation(rec)
+            return list(cached)
+        
+        system_prompt, user_prompt = self._recommendation_prompts(
+            user_context, events_context, batches, request_number, total_requests
+        )
+        messages = [
+            SystemMessage(content=system_prompt),
+            HumanMessage(content=user_prompt)
+        ]
+        
+        try:
+            recommendations = await self._astream_recommendations(messages, on_recommendation)
+            
+            self._batch_cache[cache_key] = recommendations
+            return list(recommendations)
+            
+        except Exception as e:
+            print(f"[RECOMMENDATIONS] Request {request_number} error: {e}")
+            traceback.print_exc()
+            return []
+    
+    def _build_batches_context(self, batches: list[list[dict]]) -> str:
+        """Events context with each batch's rows under a numbered heading"""
+        return _EVENT_COLUMNS + "\n\n" + "\n\n".join(
+            f"## BATCH {number} ({len(batch)} events)\n{self._event_rows(batch)}"
+            for number, batch in enumerate(batches, start=1)
+        )
+    
+    def _recommendation_prompts(
+        self,
+        user_context: str,
+        events_context: str,
+        batches: list[list[dict]],
+        request_number: int,
+        total_requests: int
+    ) -> tuple[str, str]:
+        """Build the system and user prompts for one multi-batch scoring request"""
+        events_to_process = [e for batch in batches for e in batch]
         
         system_prompt = f"""You are an intelligent event recommendation engine for GUC's campus event platform.
-Processing batch {batch_number} of {total_batches}.
+Processing request {request_number} of {total_requests}, containing {len(batches)} labeled event batches.
+
+Events are listed one per line as pipe-separated columns: id|name|type|faculty|date|rating|desc (desc is truncated).
 
 Your PRIMARY goal: Match users with events that DIRECTLY relate to their stated interests.
 
@@ -150,7 +663,7 @@ STRICT RULES:
 - A "Nutrition Workshop" or "Basketball Tournament" SHOULD be recommended to fitness enthusiasts
 - Be VERY strict about interest matching - it's the most important factor
 - Only recommend events scoring >= 70 that truly match interests
-- Return ALL matching events from this batch (we'll sort globally later)
+- Return ALL matching events from every batch (we'll sort globally later)
 
 INTEREST KEYWORD MATCHING:
 - Sports/Fitness interests → Look for: gym, fitness, basketball, football, tournament, sports, wellness, nutrition, health
@@ -158,30 +671,32 @@ INTEREST KEYWORD MATCHING:
 - Business interests → Look for: entrepreneurship, startup, business, marketing, finance, networking
 - Arts interests → Look for: art, design, photography, music, theater, creative, exhibition
 
-Return ONLY valid JSON (no markdown):
+Return ONLY valid JSON (no markdown), keyed by batch number:
 {{
-  "recommendations": [
-    {{
-      "event_id": "string",
-      "score": 70-100,
-      "reasons": ["SPECIFIC reason why this matches their interests"]
-    }}
-  ]
+  "batches": {{
+    "1": [
+      {{
+        "event_id": "string",
+        "score": 70-100,
+        "reasons": ["SPECIFIC reason why this matches their interests"]
+      }}
+    ]
+  }}
 }}"""
 
-        user_prompt = f"""Analyze this user and find matching events from this batch:
+        user_prompt = f"""Analyze this user and find matching events in each batch:
 
 USER PROFILE:
 {user_context}
 
-AVAILABLE EVENTS IN THIS BATCH ({len(events_to_process)} events):
+AVAILABLE EVENTS ({len(events_to_process)} events in {len(batches)} batches):
 {events_context}
 
 TASK:
-1. Review ALL {len(events_to_process)} events in this batch
+1. Review ALL {len(events_to_process)} events across every batch
 2. Find events that relate to the user's stated interests
 3. Score each matching event (only include events scoring >= 70)
-4. Return ALL good matches from this batch
+4. Return ALL good matches, listed under their batch number
 
 Scoring guide:
 - Direct interest match (e.g., "basketball" event for "basketball" interest) → 90-100
@@ -189,34 +704,13 @@ Scoring guide:
 - Same category (e.g., any workshop for someone who likes learning) → 60-74
 
 IMPORTANT: 
-- This is batch {batch_number} of {total_batches}
-- Return ALL events from this batch that score >= 70
-- Don't limit results - we'll sort globally across all batches
+- This is request {request_number} of {total_requests}
+- Return ALL events from every batch that score >= 70
+- Don't limit results - we'll sort globally across all requests
 
 Return ONLY the JSON object (no markdown)."""
-
-        try:
-            response = await self.llm.ainvoke([
-                SystemMessage(content=system_prompt),
-                HumanMessage(content=user_prompt)
-            ])
-            
-            import json
-            content = response.content.strip()
-            
-            if content.startswith("```"):
-                content = content.split("```")[1]
-                if content.startswith("json"):
-                    content = content[4:]
-            
-            result = json.loads(content)
-            return result.get("recommendations", [])
-            
-        except Exception as e:
-            print(f"[RECOMMENDATIONS] Batch {batch_number} error: {e}")
-            import traceback
-            traceback.print_exc()
-            return []
+        
+        return system_prompt, user_prompt
     
     def _build_user_context(
         self,
@@ -254,21 +748,35 @@ Return ONLY the JSON object (no markdown)."""
         return "\n".join(parts)
     
     def _build_events_context(self, events: list[dict]) -> str:
-        """Build context string for events with full descriptions for keyword matching"""
+        """Build context string for events: a column header plus one row per event"""
+        return f"{_EVENT_COLUMNS}\n{self._event_rows(events)}"
+    
+    def _event_rows(self, events: list[dict]) -> str:
+        """One pipe-separated row per event, in _EVENT_COLUMNS order"""
+        cache = self._event_ctx_cache
         event_strs = []
         for e in events:
-            # Include full description for better keyword matching
-            description = e.get('description', '')[:400]  # More description for better matching
-            event_str = f"""
-EVENT ID: {e.get('id')}
-Name: {e.get('name')}
-Type: {e.get('type')}
-Faculty: {e.get('faculty', 'Open to all')}
-Date: {e.get('startDate', 'TBD')}
-Full Description: {description}
-Rating: {e.get('averageRating', 'N/A')}
----"""
-            event_strs.append(event_str.strip())
+            # The BM25 prefilter handles recall, so a short description is enough.
+            # Interned because recurring events share boilerplate descriptions,
+            # so repeats share one string and compare by identity in cache keys
+            fields = (
+                e.get('id'),
+                e.get('name'),
+                e.get('type'),
+                e.get('faculty', 'Open to all'),
+                e.get('startDate', 'TBD'),
+                e.get('averageRating', 'N/A'),
+                sys.intern(e.get('description', '')[:200])
+            )
+            with self._event_ctx_lock:
+                event_str = cache.get(fields)
+            if event_str is None:
+                event_str = _EVENT_TMPL.format(
+                    *(str(field).translate(_ROW_SAFE) for field in fields)
+                )
+                with self._event_ctx_lock:
+                    cache[fields] = event_str
+            event_strs.append(event_str)
         
         return "\n".join(event_strs)
     
@@ -290,6 +798,7 @@ Rating: {e.get('averageRating', 'N/A')}
         
         system_prompt = """You are analyzing event similarity for a university event platform.
 Given a reference event and a list of candidate events, identify the most similar ones.
+Candidate events are listed one per line as pipe-separated columns: id|name|type|faculty|date|rating|desc (desc is truncated).
 
 Consider:
 - Event type
@@ -300,9 +809,17 @@ Consider:
 
 Return JSON: {similar_events: [{event_id, similarity_score, reasons}], similarity_factors: []}"""
 
-        # Process more candidates for better similarity matching (up to 50)
-        max_candidates = min(len(candidates), 50)
-        events_to_compare = candidates[:max_candidates]
+        try:
+            # Shortlist the closest candidates by embedding similarity so the
+            # LLM compares the most relevant events rather than the first 50
+            events_to_compare = await self._shortlist_similar(
+                {**event_data, "id": event_id},
+                candidates,
+                min(len(candidates), max(limit * 4, 20))
+            )
+        except Exception as e:
+            print(f"Similarity embedding error: {e}")
+            raise Exception(f"AI similarity analysis failed: {str(e)}")
         events_context = self._build_events_context(events_to_compare)
         
         user_prompt = f"""Find events similar to this one:
@@ -319,24 +836,20 @@ CANDIDATE EVENTS ({len(events_to_compare)} events to compare):
 Review ALL {len(events_to_compare)} candidate events and find up to {limit} most similar events. Return JSON only."""
 
         try:
-            response = await self.llm.ainvoke([
+            response = await self._ainvoke([
                 SystemMessage(content=system_prompt),
                 HumanMessage(content=user_prompt)
-            ])
+            ], json_mode=True)
             
-            import json
-            content = response.content.strip()
-            if content.startswith("```"):
-                content = content.split("```")[1]
-                if content.startswith("json"):
-                    content = content[4:]
-            
-            result = json.loads(content)
+            # JSON mode replies are bare objects; the fence strip only matters for
+            # models that ignore response_format
+            result = orjson.loads(_FENCE_RE.sub("", response.content).strip())
             
             # Enrich with full event data
+            by_id = {e.get("id"): e for e in candidates}
             enriched = []
             for item in result.get("similar_events", [])[:limit]:
-                event = next((e for e in candidates if e.get("id") == item.get("event_id")), None)
+                event = by_id.get(item.get("event_id"))
                 if event:
                     enriched.append({
                         **event,
@@ -354,6 +867,17 @@ Review ALL {len(events_to_compare)} candidate events and find up to {limit} most
             # No fallback - fail fast so AI issues are visible
             raise Exception(f"AI similarity analysis failed: {str(e)}")
     
+    async def _shortlist_similar(self, reference: dict, candidates: list[dict], k: int) -> list[dict]:
+        """Top-k candidates by cosine similarity to the reference event, most similar first"""
+        matrix = await self._event_embeddings.matrix([reference] + candidates)
+        scores = matrix[1:].astype(np.float32) @ matrix[0].astype(np.float32)
+        if k < len(candidates):
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(candidates))
+        top = top[np.argsort(-scores[top])]
+        return [candidates[i] for i in top]
+    
     async def analyze_trending(
         self,
         events: list[dict],
@@ -363,20 +887,17 @@ Review ALL {len(events_to_compare)} candidate events and find up to {limit} most
         """Analyze trending events"""
         
         # Note: GYM_SESSION events are already filtered at the backend level
-        # Sort by registration count or engagement
-        sorted_events = sorted(
+        # Top events by registration count or engagement
+        top_events = heapq.nlargest(
+            limit,
             events,
-            key=lambda x: x.get("registrationCount", 0),
-            reverse=True
+            key=lambda x: x.get("registrationCount", 0)
         )
         
-        trending = []
-        for i, event in enumerate(sorted_events[:limit]):
-            trending.append({
-                **event,
-                "rank": i + 1,
-                "momentum": "high" if i < 3 else "medium" if i < 7 else "growing"
-            })
+        trending = [
+            dict(event, rank=i + 1, momentum="high" if i < 3 else "medium" if i < 7 else "growing")
+            for i, event in enumerate(top_events)
+        ]
         
         return {
             "trending_events": trending,
@@ -402,7 +923,7 @@ User: {user_profile.get('role')} from {user_profile.get('faculty', 'GUC')}
 Be specific and personal."""
 
         try:
-            response = await self.llm.ainvoke([
+            response = await self._ainvoke([
                 HumanMessage(content=prompt)
             ])
             return response.content
@@ -420,3 +941,14 @@ Be specific and personal."""
             "popular_events": [],
             "message": "Integrate with backend to fetch actual data"
         }
+
+
+_shared_service: Optional[RecommendationsService] = None
+
+def get_recommendations_service() -> RecommendationsService:
+    """Process-wide RecommendationsService, so every caller shares one
+    connection pool and the same caches"""
+    global _shared_service
+    if _shared_service is None:
+        _shared_service = RecommendationsService()
+    return _shared_service
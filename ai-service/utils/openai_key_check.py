@@ -3,28 +3,59 @@ OpenAI Key Validation Utility
 
 Provides helper functions to check if OpenAI API key is configured
 and handle graceful degradation when it's not available.
+
+The key is read once, when this module is imported (after load_dotenv() in
+main.py / api/index.py). Changing OPENAI_API_KEY afterwards has no effect
+unless reset_openai_key_cache() is called.
 """
 
-import os
-from fastapi import HTTPException
+from os import environ
+from functools import lru_cache
+
+_MISSING_KEY_DETAIL = {
+    "error": "AI Service Unavailable",
+    "message": "OpenAI API key is not configured. This feature requires an OpenAI API key to function.",
+    "code": "OPENAI_KEY_NOT_CONFIGURED",
+    "suggestion": "Please set the OPENAI_API_KEY environment variable to enable AI features."
+}
+
+@lru_cache(maxsize=1)
+def _missing_key_error():
+    """The shared 503 raised by require_openai_key, built on first use so that
+    importing this module doesn't pull in FastAPI"""
+    from fastapi import HTTPException
+    return HTTPException(status_code=503, detail=_MISSING_KEY_DETAIL)
+
+def _read_key_state() -> tuple[str | None, bool]:
+    """Snapshot of the configured key and whether it is usable"""
+    key = environ.get("OPENAI_API_KEY")
+    return (key, bool(key))
 
 def check_openai_key() -> bool:
     """Check if OpenAI API key is configured"""
-    return bool(os.getenv("OPENAI_API_KEY"))
+    return _KEY_STATE[1]
 
 def require_openai_key():
     """Raise HTTPException if OpenAI key is not configured"""
-    if not check_openai_key():
-        raise HTTPException(
-            status_code=503,
-            detail={
-                "error": "AI Service Unavailable",
-                "message": "OpenAI API key is not configured. This feature requires an OpenAI API key to function.",
-                "code": "OPENAI_KEY_NOT_CONFIGURED",
-                "suggestion": "Please set the OPENAI_API_KEY environment variable to enable AI features."
-            }
-        )
+    if not _KEY_STATE[1]:
+        # Drop the previous raise's traceback so it doesn't grow with each request
+        raise _missing_key_error().with_traceback(None)
+
+def reset_openai_key_cache():
+    """Re-read OPENAI_API_KEY from the environment (e.g. after changing it in tests)"""
+    global _KEY_STATE, OPENAI_KEY, HAS_OPENAI_KEY
+    # One store swaps the whole snapshot, so the helpers never see a new key
+    # paired with a stale flag
+    _KEY_STATE = _read_key_state()
+    OPENAI_KEY, HAS_OPENAI_KEY = _KEY_STATE
 
 def get_openai_key_or_none() -> str | None:
     """Get OpenAI key or return None if not configured"""
-    return os.getenv("OPENAI_API_KEY")
+    return _KEY_STATE[0]
+
+# Immutable (key, configured) snapshot read by the helpers above
+_KEY_STATE: tuple[str | None, bool] = _read_key_state()
+
+# Read these directly in hot paths instead of calling the helpers above
+OPENAI_KEY: str | None = _KEY_STATE[0]
+HAS_OPENAI_KEY: bool = _KEY_STATE[1]